@@ -0,0 +1,50 @@
+"""Add mines to board
+
+Revision ID: dc931771a335
+Revises: e052d3422162
+Create Date: 2026-10-18 13:05:17.640822
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from srv.encoding import decode_mines
+
+# revision identifiers, used by Alembic.
+revision = 'dc931771a335'
+down_revision = 'e052d3422162'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+boards = sa.table(
+    'boards',
+    sa.column('id', sa.Unicode),
+    sa.column('mines_data', sa.LargeBinary),
+    sa.column('mines', sa.Integer),
+)
+
+
+def upgrade():
+    op.add_column('boards', sa.Column('mines', sa.Integer(), nullable=True))
+
+    connection = op.get_bind()
+    last_id = ''
+    while True:
+        rows = connection.execute(
+            sa.select([boards.c.id, boards.c.mines_data])
+            .where(boards.c.id > last_id)
+            .order_by(boards.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            mines = len(decode_mines(row['mines_data'] or b''))
+            connection.execute(boards.update().where(boards.c.id == row['id']).values(mines=mines))
+        last_id = rows[-1]['id']
+
+
+def downgrade():
+    op.drop_column('boards', 'mines')
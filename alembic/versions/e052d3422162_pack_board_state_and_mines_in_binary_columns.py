@@ -0,0 +1,91 @@
+"""Pack board state and mines in binary columns
+
+Revision ID: e052d3422162
+Revises: 53cc49779bf1
+Create Date: 2026-10-18 11:32:56.914370
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from srv.encoding import encode_grid, decode_grid, encode_mines, decode_mines
+
+# revision identifiers, used by Alembic.
+revision = 'e052d3422162'
+down_revision = '53cc49779bf1'
+branch_labels = None
+depends_on = None
+
+BATCH_SIZE = 500
+
+boards = sa.table(
+    'boards',
+    sa.column('id', sa.Unicode),
+    sa.column('rows', sa.Integer),
+    sa.column('columns', sa.Integer),
+    sa.column('mines_list', postgresql.JSON),
+    sa.column('last_plays_state', postgresql.JSON),
+    sa.column('adjacent_mines', postgresql.JSON),
+    sa.column('mines_data', sa.LargeBinary),
+    sa.column('state_data', sa.LargeBinary),
+    sa.column('adjacent_mines_data', sa.LargeBinary),
+)
+
+
+def convert_in_batches(columns, convert):
+    """
+    Walks the boards table ordered by id, BATCH_SIZE rows at a time, updating each row with `convert(row)`.
+    """
+    connection = op.get_bind()
+    last_id = ''
+    while True:
+        rows = connection.execute(
+            sa.select([boards.c.id, boards.c.rows, boards.c.columns] + [boards.c[name] for name in columns])
+            .where(boards.c.id > last_id)
+            .order_by(boards.c.id)
+            .limit(BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for row in rows:
+            connection.execute(boards.update().where(boards.c.id == row['id']).values(**convert(row)))
+        last_id = rows[-1]['id']
+
+
+def to_binary(row):
+    cols = row['columns']
+    return {
+        'mines_data': encode_mines({i * cols + j for i, j in row['mines_list'] or []}, row['rows'] * cols),
+        'state_data': encode_grid(row['last_plays_state']) if row['last_plays_state'] else None,
+        'adjacent_mines_data': encode_grid(row['adjacent_mines']) if row['adjacent_mines'] else None,
+    }
+
+
+def to_json(row):
+    rows, cols = row['rows'], row['columns']
+    return {
+        'mines_list': [list(divmod(offset, cols)) for offset in sorted(decode_mines(row['mines_data'] or b''))],
+        'last_plays_state': decode_grid(row['state_data'], rows, cols) if row['state_data'] else None,
+        'adjacent_mines': decode_grid(row['adjacent_mines_data'], rows, cols) if row['adjacent_mines_data'] else None,
+    }
+
+
+def upgrade():
+    op.add_column('boards', sa.Column('mines_data', sa.LargeBinary(), nullable=True))
+    op.add_column('boards', sa.Column('state_data', sa.LargeBinary(), nullable=True))
+    op.add_column('boards', sa.Column('adjacent_mines_data', sa.LargeBinary(), nullable=True))
+    convert_in_batches(['mines_list', 'last_plays_state', 'adjacent_mines'], to_binary)
+    op.drop_column('boards', 'adjacent_mines')
+    op.drop_column('boards', 'last_plays_state')
+    op.drop_column('boards', 'mines_list')
+
+
+def downgrade():
+    op.add_column('boards', sa.Column('mines_list', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    op.add_column('boards', sa.Column('last_plays_state', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    op.add_column('boards', sa.Column('adjacent_mines', postgresql.JSON(astext_type=sa.Text()), nullable=True))
+    convert_in_batches(['mines_data', 'state_data', 'adjacent_mines_data'], to_json)
+    op.drop_column('boards', 'adjacent_mines_data')
+    op.drop_column('boards', 'state_data')
+    op.drop_column('boards', 'mines_data')
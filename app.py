@@ -1,8 +1,12 @@
 from flask import Flask
 from flask_jwt import JWT
 
+from srv import cache
 from srv import database
-from srv.auth import identity, authenticate
+from srv import game
+from srv import metrics
+from srv import querylog
+from srv.auth import identity, authenticate, init_identity_cache
 from srv.config import load_config
 from srv import api
 from flask_cors import CORS
@@ -12,8 +16,13 @@ def create_app(config):
     app = Flask(__name__)
     app.config.from_object(config)
     database.init_db(app)
+    metrics.init_metrics(app)
+    querylog.init_query_log(app)
+    game.init_engine(app)
+    cache.init_cache(app)
     api.generate_api(app)
-    CORS(app)
+    CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
+    init_identity_cache(app)
     JWT(app, authenticate, identity)
     return app
 
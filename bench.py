@@ -0,0 +1,210 @@
+"""
+In-process benchmarks of the game engine and the board serialization, without a database.
+
+    python bench.py run --output before.json
+    python bench.py run --output after.json --engine numpy
+    python bench.py compare before.json after.json
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from srv import game
+from srv.models import Board
+from srv.schemas import BoardSchema
+
+SIZES = [(9, 9), (16, 30), (100, 100), (1000, 1000)]
+DENSITIES = [0.12, 0.2, 0.85]
+
+
+def new_board(rows, cols, mines=0, seed=0):
+    board = Board(id='bench', owner_id='bench', rows=rows, columns=cols, mines=mines, status='active',
+                  created_date=datetime.utcnow(), moves_count=0, snapshot_seq=0)
+    if mines:
+        board.generate_mines(mines, seed=seed)
+        board.compute_adjacent_mines()
+    return board
+
+
+def board_with_mines(rows, cols, mines):
+    """
+    Board with mines at the given linear offsets, and their adjacency grid.
+    """
+    board = new_board(rows, cols)
+    board.generate_mines(len(mines), exclude=set(range(rows * cols)) - set(mines))
+    board.compute_adjacent_mines()
+    return board
+
+
+def safe_cell(board):
+    return next(divmod(offset, board.columns) for offset in range(board.rows * board.columns)
+                if offset not in board.mine_index)
+
+
+def played_board(rows, cols, mines):
+    """
+    Board with every safe cell around the first one revealed, as most boards look mid game.
+    """
+    board = new_board(rows, cols, mines)
+    board.reveal(*safe_cell(board))
+    return board
+
+
+def stored_board(rows, cols, mines):
+    """
+    Played board as loaded from the database, with its state still packed.
+    """
+    board = played_board(rows, cols, mines)
+    stored = new_board(rows, cols)
+    stored.snapshot_data = board.state_data
+    stored.mines_data = board.mines_data
+    return stored
+
+
+def lost_board(rows, cols, mines):
+    board = played_board(rows, cols, mines)
+    state = board.state
+    for offset in list(board.mine_index)[::2]:
+        row, col = divmod(offset, cols)
+        state[row][col] = 'f'
+    flagged = 0
+    for i in range(rows):
+        for j in range(cols):
+            if state[i][j] == '-' and flagged < mines // 4:
+                state[i][j] = 'f'
+                flagged += 1
+    board.state = state
+    return board
+
+
+def cases(sizes, densities):
+    """
+    Yields (name, setup, run) benchmark cases, where `run` is timed on the result of a fresh `setup()`.
+    """
+    for rows, cols in sizes:
+        cells = rows * cols
+        size = '{}x{}'.format(rows, cols)
+        for density in densities:
+            mines = max(1, int(cells * density))
+            name = '{}/{}'.format(size, density)
+            yield ('generate_mines/' + name, lambda r=rows, c=cols: new_board(r, c, mines=0),
+                   lambda board, m=mines: board.generate_mines(m, seed=1))
+            yield ('compute_adjacent_mines/' + name, lambda r=rows, c=cols, m=mines: new_board(r, c, m),
+                   lambda board: board.compute_adjacent_mines())
+            yield ('reveal/' + name, lambda r=rows, c=cols, m=mines: new_board(r, c, m),
+                   lambda board: board.reveal(*safe_cell(board)))
+            yield ('count_hidden_safe_cells/' + name, lambda r=rows, c=cols, m=mines: played_board(r, c, m),
+                   lambda board: board.count_hidden_safe_cells())
+            yield ('check_end_game/' + name, lambda r=rows, c=cols, m=mines: played_board(r, c, m),
+                   lambda board: board.check_end_game())
+            yield ('check_mines_and_wrong_flags/' + name, lambda r=rows, c=cols, m=mines: lost_board(r, c, m),
+                   lambda board: board.check_mines_and_wrong_flags())
+            yield ('serialize_board/' + name, lambda r=rows, c=cols, m=mines: stored_board(r, c, m),
+                   lambda board: json.dumps(BoardSchema().dump(board)))
+        # A single mine in a corner, the reveal of the opposite corner floods the whole board
+        yield ('reveal_flood_fill/' + size, lambda r=rows, c=cols: board_with_mines(r, c, [0]),
+               lambda board: board.reveal(board.rows - 1, board.columns - 1))
+        # Every cell but one holds a mine
+        yield ('reveal_full_board/' + size, lambda r=rows, c=cols: board_with_mines(r, c, range(1, r * c)),
+               lambda board: board.reveal(0, 0))
+
+
+def measure(setup, run, min_time, max_runs):
+    """
+    Times `run` on fresh setups until `min_time` seconds were spent, setups included, and at least 3 runs were
+    timed unless a single run takes longer than `min_time`.
+    """
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < max_runs and (time.perf_counter() - started < min_time or len(timings) < 3):
+        target = setup()
+        start = time.perf_counter()
+        run(target)
+        timings.append(time.perf_counter() - start)
+        if timings[-1] > min_time:
+            break
+    return {'best': min(timings), 'median': statistics.median(timings), 'runs': len(timings)}
+
+
+def set_engine(name):
+    if name == 'numpy':
+        from srv import game_numpy
+        game.engine = game_numpy
+    else:
+        game.engine = game
+
+
+def run_benchmarks(args):
+    set_engine(args.engine)
+    sizes = [size for size in SIZES if size[0] * size[1] <= args.max_cells]
+    results = {}
+    for name, setup, run in cases(sizes, DENSITIES):
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = measure(setup, run, args.min_time, args.max_runs)
+        print('{:<50} {:>12.6f}s best {:>12.6f}s median {:>5} runs'.format(
+            name, results[name]['best'], results[name]['median'], results[name]['runs']), flush=True)
+    report = {
+        'engine': args.engine,
+        'python': platform.python_version(),
+        'date': datetime.utcnow().isoformat(),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+
+def compare(args):
+    with open(args.before) as f:
+        before = json.load(f)['results']
+    with open(args.after) as f:
+        after = json.load(f)['results']
+    regressions = 0
+    for name in sorted(set(before) & set(after)):
+        ratio = after[name]['best'] / before[name]['best'] if before[name]['best'] else float('inf')
+        flag = ''
+        if ratio > 1 + args.threshold:
+            flag = 'SLOWER'
+            regressions += 1
+        elif ratio < 1 - args.threshold:
+            flag = 'faster'
+        print('{:<50} {:>12.6f}s {:>12.6f}s {:>7.2f}x {}'.format(
+            name, before[name]['best'], after[name]['best'], ratio, flag))
+    for name in sorted(set(before) ^ set(after)):
+        print('{:<50} only in {}'.format(name, args.before if name in before else args.after))
+    return 1 if regressions and args.fail else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Game engine benchmarks')
+    subparsers = parser.add_subparsers(dest='command')
+    run_parser = subparsers.add_parser('run', help='Run the benchmarks')
+    run_parser.add_argument('--output', help='JSON file to save the results to')
+    run_parser.add_argument('--engine', choices=['python', 'numpy'], default='python')
+    run_parser.add_argument('--filter', help='Only run the benchmarks whose name contains this text')
+    run_parser.add_argument('--min-time', type=float, default=0.2, help='Seconds to spend running each benchmark')
+    run_parser.add_argument('--max-runs', type=int, default=1000)
+    run_parser.add_argument('--max-cells', type=int, default=1000 * 1000,
+                            help='Skip the board sizes with more cells than this')
+    compare_parser = subparsers.add_parser('compare', help='Compare the results of two runs')
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+    compare_parser.add_argument('--threshold', type=float, default=0.1,
+                                help='Relative difference of the best times reported as slower/faster')
+    compare_parser.add_argument('--fail', action='store_true', help='Exit with status 1 when something is slower')
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_benchmarks(args)
+    elif args.command == 'compare':
+        sys.exit(compare(args))
+    else:
+        parser.print_help()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,16 @@
+import json
 import logging
+import random
+import threading
+import time
+import uuid
+from collections import defaultdict
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 from srv.config import load_config
 from flask import Flask
 from srv import database
+from srv import game
 from srv.auth import identity, authenticate
 from srv.models import *
 from flask_jwt import JWT, _default_jwt_encode_handler
@@ -11,6 +20,7 @@ config = load_config()
 app = Flask(__name__)
 app.config.from_object(config)
 database.init_db(app)
+game.init_engine(app)
 JWT(app, authenticate, identity)
 
 session = database.session
@@ -23,3 +33,96 @@ def token_for(username):
             return _default_jwt_encode_handler(u)
         else:
             logging.error("There is no User with username={}".format(username))
+
+
+class Bot(threading.Thread):
+    """
+    Player hitting the API over HTTP: registers its user, then creates boards and reveals random hidden cells until
+    each game is over, recording the latency of every request by endpoint.
+    """
+
+    def __init__(self, base_url, games, rows, columns, mines, timings, errors):
+        super().__init__(daemon=True)
+        self.base_url = base_url
+        self.games = games
+        self.rows = rows
+        self.columns = columns
+        self.mines = mines
+        self.timings = timings
+        self.errors = errors
+        self.username = 'bot-{}'.format(uuid.uuid4().hex[:12])
+        self.token = None
+
+    def call(self, method, endpoint, path, body=None):
+        headers = {'Content-Type': 'application/json'}
+        if self.token:
+            headers['Authorization'] = 'JWT {}'.format(self.token)
+        data = json.dumps(body).encode('utf-8') if body is not None else None
+        request = Request(self.base_url + path, data=data, headers=headers, method=method)
+        start = time.perf_counter()
+        try:
+            with urlopen(request) as response:
+                payload = json.loads(response.read().decode('utf-8'))
+        except HTTPError as e:
+            self.errors[endpoint][e.code] += 1
+            return None
+        finally:
+            self.timings[endpoint].append(time.perf_counter() - start)
+        return payload
+
+    def run(self):
+        password = uuid.uuid4().hex
+        if self.call('POST', 'POST /register', '/register', {'username': self.username, 'password': password}) is None:
+            return
+        token = token_for(self.username)
+        self.token = token.decode('utf-8') if isinstance(token, bytes) else token
+        for _ in range(self.games):
+            board = self.call('POST', 'POST /boards', '/boards',
+                              {'rows': self.rows, 'columns': self.columns, 'mines': self.mines})
+            if board is None:
+                continue
+            while board['status'] == 'active':
+                hidden = [(i, j) for i, row in enumerate(board['state']) for j, value in enumerate(row) if value == '-']
+                row, col = random.choice(hidden)
+                played = self.call('POST', 'POST /boards/{id}/reveal', '/boards/{}/reveal'.format(board['id']),
+                                   {'row': row, 'col': col})
+                if played is None:
+                    break
+                board = played
+            self.call('GET', 'GET /boards/{id}', '/boards/{}'.format(board['id']))
+            self.call('GET', 'GET /boards', '/boards')
+
+
+def percentile(timings, percent):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100))]
+
+
+def load_test(base_url='http://localhost:5001', bots=10, games=5, rows=9, columns=9, mines=10):
+    """
+    Plays `games` games with each of `bots` concurrent bots against the API running at `base_url` (which must use
+    this console's database, where the bots get their tokens), and prints the throughput and latency percentiles
+    of each endpoint.
+    """
+    timings = defaultdict(list)
+    errors = defaultdict(lambda: defaultdict(int))
+    players = [Bot(base_url, games, rows, columns, mines, timings, errors) for _ in range(bots)]
+    start = time.perf_counter()
+    for player in players:
+        player.start()
+    for player in players:
+        player.join()
+    elapsed = time.perf_counter() - start
+    print('{} bots, {} games each, {}x{} boards with {} mines, {:.1f}s'.format(bots, games, rows, columns, mines,
+                                                                                elapsed))
+    print('{:<28} {:>8} {:>8} {:>9} {:>9} {:>9} {:>9}'.format('endpoint', 'requests', 'errors', 'req/s',
+                                                              'p50 ms', 'p95 ms', 'p99 ms'))
+    for endpoint in sorted(timings):
+        endpoint_timings = timings[endpoint]
+        print('{:<28} {:>8} {:>8} {:>9.1f} {:>9.1f} {:>9.1f} {:>9.1f}'.format(
+            endpoint, len(endpoint_timings), sum(errors[endpoint].values()), len(endpoint_timings) / elapsed,
+            percentile(endpoint_timings, 50) * 1000, percentile(endpoint_timings, 95) * 1000,
+            percentile(endpoint_timings, 99) * 1000))
+    for endpoint in sorted(errors):
+        for status, count in sorted(errors[endpoint].items()):
+            print('{} answered {} {} times'.format(endpoint, status, count))
@@ -0,0 +1,7 @@
+# Gunicorn settings, see Procfile
+
+
+def post_fork(server, worker):
+    # With preload_app the master already created the database engine, its pooled connections can't be shared
+    from srv import database
+    database.reset_pool()
@@ -1,7 +1,8 @@
 from flask_restful import Api
 from flask_restful_swagger_2 import Api
 from .resources import (RegisterResource, RevealResource, BoardsResource, SingleBoardResource, FlagResource,
-                        PauseBoardResource, ResumeBoardResource, PingProtectedResource)
+                        PauseBoardResource, ResumeBoardResource, PingProtectedResource, MovesResource,
+                        ChordResource)
 
 
 def generate_api(app):
@@ -12,6 +13,8 @@ def generate_api(app):
     api.add_resource(RegisterResource, '/register')
     api.add_resource(RevealResource, '/boards/<string:board_id>/reveal')
     api.add_resource(FlagResource, '/boards/<string:board_id>/flag')
+    api.add_resource(ChordResource, '/boards/<string:board_id>/chord')
+    api.add_resource(MovesResource, '/boards/<string:board_id>/moves')
     api.add_resource(PauseBoardResource, '/boards/<string:board_id>/pause')
     api.add_resource(ResumeBoardResource, '/boards/<string:board_id>/resume')
     api.add_resource(BoardsResource, '/boards')
@@ -1,7 +1,78 @@
+import threading
+import time
+from collections import OrderedDict
+import sqlalchemy as sa
 from . import database as db
 from . import models as m
 
 
+class UserIdentity(object):
+    """
+    Lightweight stand in for an authenticated User, enough for ownership checks without loading the User row.
+    """
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+    def __repr__(self):
+        return '<UserIdentity id={} username={}>'.format(self.id, self.username)
+
+
+class IdentityCache(object):
+    """
+    Per worker LRU of user identities by user id, each one kept for at most `ttl` seconds.
+    """
+
+    def __init__(self, size=10000, ttl=60):
+        self.size = size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, user_id):
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is None:
+                return None
+            expires, identity = entry
+            if expires < time.time():
+                del self.entries[user_id]
+                return None
+            self.entries.move_to_end(user_id)
+            return identity
+
+    def put(self, identity):
+        with self.lock:
+            self.entries[identity.id] = (time.time() + self.ttl, identity)
+            self.entries.move_to_end(identity.id)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+identity_cache = IdentityCache()
+
+
+def init_identity_cache(app):
+    global identity_cache
+    identity_cache = IdentityCache(size=app.config.get('IDENTITY_CACHE_SIZE', 10000),
+                                   ttl=app.config.get('IDENTITY_CACHE_TTL', 60))
+
+
+@sa.event.listens_for(m.User, 'after_update')
+@sa.event.listens_for(m.User, 'after_delete')
+def invalidate_user_identity(mapper, connection, user):
+    identity_cache.invalidate(user.id)
+
+
 def authenticate(username, password):
     user = db.session.query(m.User).filter(m.User.username == username).first()
     if user:
@@ -11,4 +82,10 @@ def authenticate(username, password):
 
 def identity(payload):
     user_eid = payload['identity']
-    return db.session.query(m.User).filter(m.User.id == user_eid).first()
+    user_identity = identity_cache.get(user_eid)
+    if user_identity is None:
+        user = db.session.query(m.User.id, m.User.username).filter(m.User.id == user_eid).first()
+        if user:
+            user_identity = UserIdentity(user.id, user.username)
+            identity_cache.put(user_identity)
+    return user_identity
@@ -0,0 +1,222 @@
+import atexit
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+import sqlalchemy as sa
+from flask import g, has_request_context
+from sqlalchemy.orm.attributes import flag_modified, set_committed_value
+from sqlalchemy.orm.exc import StaleDataError
+from . import database as db
+
+logger = logging.getLogger(__name__)
+
+# Cache of the boards being played in this worker, None when BOARD_CACHE_ENABLED is off
+board_cache = None
+
+
+def init_cache(app):
+    global board_cache
+    if app.config.get('BOARD_CACHE_ENABLED'):
+        board_cache = BoardCache(size=app.config.get('BOARD_CACHE_SIZE', 1000),
+                                 idle_seconds=app.config.get('BOARD_CACHE_IDLE_SECONDS', 300),
+                                 flush_every=app.config.get('BOARD_CACHE_FLUSH_EVERY', 10),
+                                 snapshot_every=app.config.get('BOARD_SNAPSHOT_EVERY', 50))
+        atexit.register(board_cache.flush_all)
+    else:
+        board_cache = None
+
+
+class CachedBoard(object):
+    def __init__(self, board):
+        self.board = board
+        self.moves = 0
+        self.last_used = time.time()
+
+
+def unsaved_state(board):
+    """
+    Column values, modified columns and logged moves of `board`, to put it back as it was when it can't be saved.
+    """
+    state = sa.inspect(board)
+    columns = [attr.key for attr in state.mapper.column_attrs if attr.key in state.dict]
+    modified = [key for key in columns if state.attrs[key].history.has_changes()]
+    return {key: state.dict[key] for key in columns}, modified, list(board.logged_moves)
+
+
+def restore_unsaved_state(board, unsaved):
+    """
+    Undoes a failed save of `board`: the rollback expired its columns, and the flush may have bumped its version.
+    """
+    values, modified, moves = unsaved
+    for key, value in values.items():
+        set_committed_value(board, key, value)
+    for key in modified:
+        flag_modified(board, key)
+    board.logged_moves[:0] = moves
+
+
+@contextmanager
+def writing_boards():
+    """
+    Flags the statements writing cached boards, which are not counted in the query budget of the request running
+    them since they may belong to other requests.
+    """
+    if not has_request_context():
+        yield
+        return
+    g.writing_board_cache = True
+    try:
+        yield
+    finally:
+        g.writing_board_cache = False
+
+
+class BoardCache(object):
+    """
+    LRU cache of detached boards with write-behind persistence. Moves are applied to the cached board and
+    written to the database every `flush_every` moves, when the game ends, and when the board is evicted
+    (because the cache is full, it was idle for `idle_seconds` or it is about to be paused or resumed). A board
+    only leaves the cache once its moves are written, idle boards are written by a background thread.
+
+    Each worker has its own cache, so requests for a board must always be routed to the same worker.
+    """
+
+    def __init__(self, size, idle_seconds, flush_every, snapshot_every=50):
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.flush_every = flush_every
+        self.snapshot_every = snapshot_every
+        self.entries = OrderedDict()
+        self.lock = threading.RLock()
+        self.idle_evictions = None
+
+    def get(self, board_id, owner_id):
+        """
+        Gets the cached board if it is owned by `owner_id`. Requests for the boards of other users get None, and
+        don't move the board in the LRU order.
+        """
+        with self.lock:
+            entry = self.entries.get(board_id)
+            if entry is None or entry.board.owner_id != owner_id:
+                return None
+            self.entries.move_to_end(board_id)
+            entry.last_used = time.time()
+            return entry.board
+
+    def pending_moves(self, board_id):
+        """
+        Number of moves played on the cached board since it was last written to the database.
+        """
+        with self.lock:
+            entry = self.entries.get(board_id)
+            return entry.moves if entry is not None else 0
+
+    def add(self, board):
+        """
+        Detaches `board`, a fully loaded board of the current session, and keeps it in the cache.
+        """
+        with self.lock:
+            board.load_state()
+            db.session.expunge(board)
+            db.session.commit()
+            self.entries[board.id] = CachedBoard(board)
+            while len(self.entries) > self.size:
+                self.evict_or_drop(next(iter(self.entries)))
+        self.start_idle_evictions()
+
+    def played(self, board, moves=1):
+        with self.lock:
+            entry = self.entries[board.id]
+            entry.moves += moves
+            if board.status != 'active':
+                self.evict(board.id)
+            elif entry.moves >= self.flush_every:
+                self.flush(entry)
+
+    def flush(self, entry):
+        """
+        Writes the moves played on the cached board. When that fails the board is left as it was, with its moves
+        still to be written, unless it was updated out of the cache and is dropped.
+        """
+        if not entry.moves:
+            return
+        board = entry.board
+        board_id = board.id
+        unsaved = unsaved_state(board)
+        try:
+            with writing_boards():
+                db.session.add(board)
+                board.save_moves(db.session, self.snapshot_every)
+                db.session.flush()
+                db.session.expunge(board)
+                db.session.commit()
+        except Exception as e:
+            if board in db.session:
+                db.session.expunge(board)
+            db.session.rollback()
+            if isinstance(e, StaleDataError):
+                self.discard(board_id)
+            else:
+                restore_unsaved_state(board, unsaved)
+            raise
+        entry.moves = 0
+
+    def evict(self, board_id):
+        with self.lock:
+            entry = self.entries.get(board_id)
+            if entry is not None:
+                self.flush(entry)
+                self.entries.pop(board_id, None)
+
+    def evict_or_drop(self, board_id):
+        """
+        Evicts the board for reasons unrelated to the current request, which must not fail because of it: a board
+        that can't be written is logged and dropped with its moves instead.
+        """
+        with self.lock:
+            try:
+                self.evict(board_id)
+            except Exception:
+                logger.exception('Dropped the cached board %s without writing its %s moves', board_id,
+                                 self.pending_moves(board_id))
+                self.discard(board_id)
+
+    def discard(self, board_id):
+        """
+        Drops the cached board without writing it, when it was updated out of the cache since it was read.
+        """
+        with self.lock:
+            self.entries.pop(board_id, None)
+
+    def evict_idle(self):
+        limit = time.time() - self.idle_seconds
+        with self.lock:
+            for board_id, entry in list(self.entries.items()):
+                if entry.last_used >= limit:
+                    break
+                self.evict_or_drop(board_id)
+
+    def start_idle_evictions(self):
+        """
+        Starts the thread evicting idle boards, on the first board cached so that it runs in the worker process.
+        """
+        with self.lock:
+            if self.idle_evictions is None:
+                self.idle_evictions = threading.Thread(target=self.evict_idle_forever, name='board-cache-evictions',
+                                                       daemon=True)
+                self.idle_evictions.start()
+
+    def evict_idle_forever(self):
+        while True:
+            time.sleep(min(self.idle_seconds, 60))
+            try:
+                self.evict_idle()
+            finally:
+                db.session.remove()
+
+    def flush_all(self):
+        with self.lock:
+            for board_id in list(self.entries):
+                self.evict_or_drop(board_id)
@@ -25,12 +25,54 @@ class Config(object):
     CSRF_ENABLED = True
     SECRET_KEY = 'this-really-needs-to-be-changed'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL')
+    # Connection pool of each worker, timeouts in seconds (statement timeout in milliseconds, None to disable)
+    SQLALCHEMY_POOL_SIZE = 5
+    SQLALCHEMY_MAX_OVERFLOW = 10
+    SQLALCHEMY_POOL_TIMEOUT = 30
+    SQLALCHEMY_POOL_RECYCLE = 1800
+    SQLALCHEMY_POOL_PRE_PING = True
+    SQLALCHEMY_STATEMENT_TIMEOUT = None
     JWT_EXPIRATION_DELTA = timedelta(seconds=60*60*48)
+    # werkzeug hash method for new passwords, the last part is the number of PBKDF2 iterations
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:50000'
+    # Per worker cache of the identities of authenticated users
+    IDENTITY_CACHE_SIZE = 10000
+    IDENTITY_CACHE_TTL = 60
+    # Boards are created without mines, which are placed on the first reveal away from the revealed cell
+    LAZY_MINE_PLACEMENT = False
+    # Engine for the full-board passes: 'python', or 'numpy' when NumPy is installed
+    BOARD_ENGINE = 'python'
+    # Per worker cache of the boards being played, needs requests routed to workers by board id (see README)
+    BOARD_CACHE_ENABLED = False
+    BOARD_CACHE_SIZE = 1000
+    BOARD_CACHE_IDLE_SECONDS = 300
+    BOARD_CACHE_FLUSH_EVERY = 10
+    # 'pessimistic' locks boards with SELECT ... FOR UPDATE while they are updated, 'optimistic' updates them
+    # only if their version did not change since they were read, retrying conflicts before answering 409
+    BOARD_LOCKING = 'pessimistic'
+    BOARD_UPDATE_RETRIES = 3
+    # Moves are logged in board_moves, and the board state is only written every BOARD_SNAPSHOT_EVERY moves
+    # and when the board stops being active
+    BOARD_SNAPSHOT_EVERY = 50
+    # Per worker latency, SQL and serialization histograms of every endpoint, exposed on /metrics without
+    # authentication, so only enable it where /metrics can't be reached from outside
+    METRICS_ENABLED = False
+    # SQL statements taking at least this many milliseconds are logged with their endpoint, None to disable
+    SLOW_QUERY_THRESHOLD_MS = None
+    # Requests fail as soon as they run more SQL statements than the query_budget of their resource
+    QUERY_BUDGETS_ENFORCED = False
 
 
 class ProductionConfig(Config):
     DEBUG = False
     PROPAGATE_EXCEPTIONS = True
+    SQLALCHEMY_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    SQLALCHEMY_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 5))
+    SQLALCHEMY_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', 10))
+    SQLALCHEMY_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+    SQLALCHEMY_STATEMENT_TIMEOUT = int(os.environ.get('DB_STATEMENT_TIMEOUT', 5000))
+    SLOW_QUERY_THRESHOLD_MS = int(os.environ.get('DB_SLOW_QUERY_MS', 500))
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '').lower() in ('1', 'true')
 
 
 class DevelopmentConfig(Config):
@@ -38,3 +80,19 @@ class DevelopmentConfig(Config):
     DEVELOPMENT = True
     DEBUG = True
     JWT_EXPIRATION_DELTA = timedelta(seconds=6000)
+    SQLALCHEMY_POOL_SIZE = 2
+    SQLALCHEMY_MAX_OVERFLOW = 2
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    METRICS_ENABLED = True
+    SLOW_QUERY_THRESHOLD_MS = 100
+    QUERY_BUDGETS_ENFORCED = True
+
+
+class TestingConfig(Config):
+    TESTING = True
+    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL', 'postgresql://minesweeper@localhost:5432/minesweeper_test')
+    SQLALCHEMY_POOL_SIZE = 2
+    SQLALCHEMY_MAX_OVERFLOW = 2
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
+    SLOW_QUERY_THRESHOLD_MS = 100
+    QUERY_BUDGETS_ENFORCED = True
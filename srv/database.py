@@ -1,10 +1,70 @@
+import time
 from sqlalchemy import create_engine
 from sqlalchemy.orm import scoped_session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from . import models
 
+engine = None
+session = None
+
+# Totals of this worker pool checkouts, see pool_stats
+checkout_totals = {
+    'checkouts': 0,
+    'wait_time': 0.0,
+}
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool keeping count of the checkouts and of the time spent waiting for a connection.
+    """
+
+    def _do_get(self):
+        start = time.time()
+        try:
+            return super(TimedQueuePool, self)._do_get()
+        finally:
+            checkout_totals['checkouts'] += 1
+            checkout_totals['wait_time'] += time.time() - start
+
 
 def init_db(app):
-    global session
-    engine = create_engine(app.config.get('SQLALCHEMY_DATABASE_URI'), convert_unicode=True)
+    global engine, session
+    config = app.config
+    connect_args = {}
+    if config.get('SQLALCHEMY_STATEMENT_TIMEOUT'):
+        connect_args['options'] = '-c statement_timeout={}'.format(config.get('SQLALCHEMY_STATEMENT_TIMEOUT'))
+    engine = create_engine(config.get('SQLALCHEMY_DATABASE_URI'), convert_unicode=True,
+                           poolclass=TimedQueuePool,
+                           pool_size=config.get('SQLALCHEMY_POOL_SIZE', 5),
+                           max_overflow=config.get('SQLALCHEMY_MAX_OVERFLOW', 10),
+                           pool_timeout=config.get('SQLALCHEMY_POOL_TIMEOUT', 30),
+                           pool_recycle=config.get('SQLALCHEMY_POOL_RECYCLE', -1),
+                           pool_pre_ping=config.get('SQLALCHEMY_POOL_PRE_PING', False),
+                           connect_args=connect_args)
     session = scoped_session(sessionmaker(autocommit=False, autoflush=False, bind=engine))
     models.Base.metadata.create_all(bind=engine)
+
+    @app.teardown_appcontext
+    def remove_session(exception=None):
+        session.remove()
+
+
+def reset_pool():
+    """
+    Drops the connections inherited from a parent process. To be called in every worker right after fork.
+    """
+    if engine is not None:
+        engine.dispose()
+
+
+def pool_stats():
+    pool = engine.pool
+    return {
+        'size': pool.size(),
+        'checked_in': pool.checkedin(),
+        'checked_out': pool.checkedout(),
+        'overflow': max(pool.overflow(), 0),
+        'checkouts': checkout_totals['checkouts'],
+        'wait_time': checkout_totals['wait_time'],
+    }
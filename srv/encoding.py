@@ -0,0 +1,54 @@
+from itertools import chain
+
+# Cell values by their 4 bits code. Codes 0-8 are revealed cells with their number of neighboring mines.
+CELL_VALUES = [0, 1, 2, 3, 4, 5, 6, 7, 8, '-', 'f', '@', 'w', 'x', None, None]
+CELL_CODES = {value: code for code, value in enumerate(CELL_VALUES) if value is not None}
+
+_BYTE_CELLS = [(CELL_VALUES[b >> 4], CELL_VALUES[b & 0x0f]) for b in range(256)]
+
+
+def encode_grid(grid):
+    """
+    Packs a matrix of cell values in 4 bits per cell, two cells per byte (first cell in the high nibble).
+    """
+    codes = [CELL_CODES[value] for row in grid for value in row]
+    if len(codes) % 2:
+        codes.append(0)
+    return bytes(high << 4 | low for high, low in zip(codes[0::2], codes[1::2]))
+
+
+def decode_grid(data, rows, cols):
+    cells = list(chain.from_iterable(map(_BYTE_CELLS.__getitem__, data)))
+    return [cells[i * cols:(i + 1) * cols] for i in range(rows)]
+
+
+def replace_cells(data, cells):
+    """
+    Returns a copy of the packed grid `data` with the cells of the (linear offset, value) pairs `cells` replaced.
+    """
+    data = bytearray(data)
+    for offset, value in cells:
+        code = CELL_CODES[value]
+        if offset % 2:
+            data[offset // 2] = data[offset // 2] & 0xf0 | code
+        else:
+            data[offset // 2] = data[offset // 2] & 0x0f | code << 4
+    return bytes(data)
+
+
+def encode_mines(mines, cells):
+    """
+    Packs a set of mine linear offsets in a bitmap of `cells` bits (offset 0 is the high bit of the first byte).
+    """
+    bitmap = bytearray((cells + 7) // 8)
+    for offset in mines:
+        bitmap[offset // 8] |= 0x80 >> offset % 8
+    return bytes(bitmap)
+
+
+def decode_mines(data):
+    mines = set()
+    for index, byte in enumerate(data):
+        if byte:
+            mines.update(index * 8 + bit for bit in range(8) if byte & 0x80 >> bit)
+    return mines
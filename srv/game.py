@@ -0,0 +1,112 @@
+import logging
+import random
+import sys
+from collections import deque
+
+# Module implementing the full-board passes (count_adjacent_mines, count_hidden_safe_cells and
+# mines_and_wrong_flags), selected with the BOARD_ENGINE setting.
+engine = sys.modules[__name__]
+
+
+def init_engine(app):
+    global engine
+    engine = sys.modules[__name__]
+    if app.config.get('BOARD_ENGINE', 'python') == 'numpy':
+        try:
+            from . import game_numpy
+            engine = game_numpy
+        except ImportError:
+            logging.warning("NumPy is not installed, using the python board engine")
+
+
+def neighbors(rows, cols, row, col):
+    for i in range(max(row - 1, 0), min(row + 2, rows)):
+        for j in range(max(col - 1, 0), min(col + 2, cols)):
+            if i != row or j != col:
+                yield i, j
+
+
+def place_mines(cells, mines, seed=None, exclude=()):
+    """
+    Picks `mines` distinct linear offsets out of `cells` cells, never using an offset in `exclude`. When more
+    than half of the allowed cells hold a mine, the free cells are sampled instead. The same `seed` always gives
+    the same mines.
+    """
+    rng = random.Random(seed)
+    excluded = sorted(exclude)
+    allowed = cells - len(excluded)
+
+    def to_offset(index):
+        # index is a position among the allowed cells, skip the excluded ones before it
+        for offset in excluded:
+            if offset > index:
+                break
+            index += 1
+        return index
+
+    if mines * 2 > allowed:
+        free = {to_offset(index) for index in rng.sample(range(allowed), allowed - mines)}
+        return {to_offset(index) for index in range(allowed)} - free
+    return {to_offset(index) for index in rng.sample(range(allowed), mines)}
+
+
+def count_adjacent_mines(mines, rows, cols):
+    """
+    Builds the grid with the number of neighboring mines of every cell.
+
+    `mines` is a set of linear offsets (row * cols + col) of the cells holding a mine.
+    """
+    grid = [[0 for j in range(cols)] for i in range(rows)]
+    for offset in mines:
+        for i, j in neighbors(rows, cols, offset // cols, offset % cols):
+            grid[i][j] += 1
+    return grid
+
+
+def count_hidden_safe_cells(board):
+    state = board.state
+    return sum(
+        1 for row in range(board.rows) for col in range(board.columns)
+        if state[row][col] in ('-', 'f') and not board.is_mine(row, col)
+    )
+
+
+def mines_and_wrong_flags(board):
+    """
+    Cells to show once a game is lost, as [row, col, value] items: unflagged mines become '@' and flags
+    without a mine become 'w'.
+    """
+    state = board.state
+    changes = []
+    for row in range(board.rows):
+        for col in range(board.columns):
+            if state[row][col] == '-' and board.is_mine(row, col):
+                changes.append([row, col, '@'])
+            elif state[row][col] == 'f' and not board.is_mine(row, col):
+                changes.append([row, col, 'w'])
+    return changes
+
+
+def reveal_cell(adjacent_mines, rows, cols, state, row, col):
+    """
+    Reveals the cell at (row, col) and, when it has no neighboring mines, every cell
+    connected to it through other empty cells. Each cell is visited at most once.
+
+    `adjacent_mines` is the grid built by `count_adjacent_mines`. Returns the list of revealed cells.
+    """
+    queue = deque([(row, col)])
+    seen = {(row, col)}
+    revealed = []
+
+    while queue:
+        i, j = queue.popleft()
+        state[i][j] = adjacent_mines[i][j]
+        revealed.append((i, j))
+
+        if state[i][j] == 0:
+            for n in neighbors(rows, cols, i, j):
+                if n not in seen and not isinstance(state[n[0]][n[1]], int):
+                    seen.add(n)
+                    queue.append(n)
+
+    return revealed
@@ -0,0 +1,58 @@
+"""
+NumPy implementation of the full-board passes of `srv.game`. These passes read the packed `state_data` and
+`mines_data` columns of the board directly instead of its decoded matrices.
+"""
+import numpy as np
+from .encoding import CELL_CODES
+
+HIDDEN = CELL_CODES['-']
+FLAGGED = CELL_CODES['f']
+
+
+def state_codes(board):
+    cells = board.rows * board.columns
+    if not board.state_data:
+        return np.full(cells, HIDDEN, dtype=np.uint8)
+    packed = np.frombuffer(board.state_data, dtype=np.uint8)
+    codes = np.empty(packed.size * 2, dtype=np.uint8)
+    codes[0::2] = packed >> 4
+    codes[1::2] = packed & 0x0f
+    return codes[:cells]
+
+
+def mine_mask(board):
+    cells = board.rows * board.columns
+    if not board.mines_data:
+        return np.zeros(cells, dtype=bool)
+    return np.unpackbits(np.frombuffer(board.mines_data, dtype=np.uint8))[:cells].astype(bool)
+
+
+def count_adjacent_mines(mines, rows, cols):
+    """
+    Convolves the mines mask with a 3x3 kernel of ones (without its center), as a sum of shifted views of the
+    zero padded mask.
+    """
+    mask = np.zeros(rows * cols, dtype=np.uint8)
+    mask[np.fromiter(mines, dtype=np.int64, count=len(mines))] = 1
+    padded = np.pad(mask.reshape(rows, cols), 1, mode='constant')
+    grid = np.zeros((rows, cols), dtype=np.uint8)
+    for i in range(3):
+        for j in range(3):
+            if i != 1 or j != 1:
+                grid += padded[i:i + rows, j:j + cols]
+    return grid.tolist()
+
+
+def count_hidden_safe_cells(board):
+    codes = state_codes(board)
+    return int(np.count_nonzero(((codes == HIDDEN) | (codes == FLAGGED)) & ~mine_mask(board)))
+
+
+def mines_and_wrong_flags(board):
+    codes = state_codes(board)
+    mines = mine_mask(board)
+    changed = np.flatnonzero(((codes == HIDDEN) & mines) | ((codes == FLAGGED) & ~mines))
+    rows = (changed // board.columns).tolist()
+    cols = (changed % board.columns).tolist()
+    values = np.where(mines[changed], '@', 'w').tolist()
+    return [list(cell) for cell in zip(rows, cols, values)]
@@ -0,0 +1,130 @@
+import threading
+import time
+from bisect import bisect_left
+import sqlalchemy as sa
+from flask import g, request, has_request_context, Response
+from . import database as db
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 50, 100)
+
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram(object):
+    """
+    Prometheus histogram of this worker, with a series of buckets per combination of label values.
+    """
+
+    def __init__(self, name, description, buckets, labels=('endpoint', 'method')):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.labels = labels
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, label_values, value):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = {'buckets': [0] * len(self.buckets), 'sum': 0, 'count': 0}
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series['buckets'][index] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        with self.lock:
+            for label_values, series in sorted(self.series.items()):
+                labels = ','.join('{}="{}"'.format(label, value) for label, value in zip(self.labels, label_values))
+                cumulative = 0
+                for bound, count in zip(self.buckets, series['buckets']):
+                    cumulative += count
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, labels, bound, cumulative))
+                lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.name, labels, series['count']))
+                lines.append('{}_sum{{{}}} {}'.format(self.name, labels, series['sum']))
+                lines.append('{}_count{{{}}} {}'.format(self.name, labels, series['count']))
+        return lines
+
+
+request_duration = Histogram('minesweeper_request_duration_seconds', 'Time spent answering requests',
+                             LATENCY_BUCKETS)
+request_queries = Histogram('minesweeper_request_queries', 'SQL statements executed per request', QUERY_BUCKETS)
+request_db_duration = Histogram('minesweeper_request_db_duration_seconds',
+                                'Time spent executing SQL statements per request', LATENCY_BUCKETS)
+request_serialization_duration = Histogram('minesweeper_request_serialization_duration_seconds',
+                                           'Time spent serializing responses per request', LATENCY_BUCKETS)
+histograms = [request_duration, request_queries, request_db_duration, request_serialization_duration]
+
+
+def init_metrics(app):
+    """
+    Measures every request of this worker and exposes the measures, with the database pool usage, on /metrics.
+    """
+    if not app.config.get('METRICS_ENABLED'):
+        return
+    sa.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    sa.event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+    app.before_request(start_request)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
+
+
+def start_request():
+    g.request_start = time.perf_counter()
+    g.sql_queries = 0
+    g.sql_time = 0.0
+    g.serialization_time = 0.0
+
+
+def record_request(response):
+    if 'request_start' in g:
+        labels = (request.endpoint or 'unknown', request.method)
+        request_duration.observe(labels, time.perf_counter() - g.request_start)
+        request_queries.observe(labels, g.sql_queries)
+        request_db_duration.observe(labels, g.sql_time)
+        request_serialization_duration.observe(labels, g.serialization_time)
+    return response
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if has_request_context() and 'request_start' in g:
+        g.sql_queries += 1
+        g.sql_time += elapsed
+
+
+def record_serialization(elapsed):
+    if has_request_context() and 'request_start' in g:
+        g.serialization_time += elapsed
+
+
+def metrics():
+    lines = []
+    for histogram in histograms:
+        lines.extend(histogram.render())
+    stats = db.pool_stats()
+    lines.extend([
+        '# HELP minesweeper_db_pool_connections Connections of the database pool by state',
+        '# TYPE minesweeper_db_pool_connections gauge',
+        'minesweeper_db_pool_connections{{state="checked_in"}} {}'.format(stats['checked_in']),
+        'minesweeper_db_pool_connections{{state="checked_out"}} {}'.format(stats['checked_out']),
+        'minesweeper_db_pool_connections{{state="overflow"}} {}'.format(stats['overflow']),
+        '# HELP minesweeper_db_pool_size Size of the database pool',
+        '# TYPE minesweeper_db_pool_size gauge',
+        'minesweeper_db_pool_size {}'.format(stats['size']),
+        '# HELP minesweeper_db_pool_checkouts_total Connections checked out of the database pool',
+        '# TYPE minesweeper_db_pool_checkouts_total counter',
+        'minesweeper_db_pool_checkouts_total {}'.format(stats['checkouts']),
+        '# HELP minesweeper_db_pool_wait_seconds_total Time spent waiting for a connection of the database pool',
+        '# TYPE minesweeper_db_pool_wait_seconds_total counter',
+        'minesweeper_db_pool_wait_seconds_total {}'.format(stats['wait_time']),
+    ])
+    return Response('\n'.join(lines) + '\n', content_type=PROMETHEUS_MIMETYPE)
@@ -1,13 +1,13 @@
-import copy
-import random
 import sqlalchemy as sa
-from sqlalchemy.dialects import postgresql
-from sqlalchemy.orm import relationship
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
 from sqlalchemy.ext.declarative import declarative_base
 import uuid
 import base64
+from . import game
+from .game import neighbors, place_mines, reveal_cell
+from .encoding import encode_grid, decode_grid, replace_cells, encode_mines, decode_mines
 
 Base = declarative_base()
 
@@ -18,36 +18,6 @@ def generate_id():
     return b[0:18].decode('utf-8')
 
 
-def reveal_cell(mines_list, rows, cols, state, row, col):
-    i_top = row - 1 if row > 0 else row
-    j_left = col - 1 if col > 0 else col
-    i_bottom = row + 1 if row < rows - 1 else row
-    j_right = col + 1 if col < cols - 1 else col
-
-    neighbor_mines = 0
-    neighbors_list = []
-
-    for i in range(i_top, i_bottom + 1):
-        for j in range(j_left, j_right + 1):
-            if i == row and j == col:
-                continue
-            if isinstance(state[i][j], int):
-                continue
-            neighbors_list.append((i, j))
-
-    for i, j in neighbors_list:
-        if [i, j] in mines_list:
-            neighbor_mines += 1
-
-    state[row][col] = neighbor_mines
-
-    if neighbor_mines == 0:
-        for i, j in neighbors_list:
-            state = reveal_cell(mines_list, rows, cols, state, i, j)
-
-    return state
-
-
 class User(Base):
     __tablename__ = 'users'
     id = sa.Column(sa.Unicode(25), primary_key=True, default=generate_id)
@@ -57,8 +27,8 @@ class User(Base):
 
     boards = relationship("Board")
 
-    def set_password(self, password):
-        self.password = generate_password_hash(password)
+    def set_password(self, password, method='pbkdf2:sha256'):
+        self.password = generate_password_hash(password, method=method)
 
     def check_password(self, password):
         return check_password_hash(self.password, password)
@@ -69,6 +39,9 @@ class User(Base):
 
 class Board(Base):
     __tablename__ = 'boards'
+    __table_args__ = (
+        sa.Index('ix_boards_owner_id_status_created_date_id', 'owner_id', 'status', 'created_date', 'id'),
+    )
 
     id = sa.Column(sa.Unicode(25), primary_key=True, default=generate_id)
     created_date = sa.Column(sa.DateTime, nullable=False, default=datetime.utcnow)
@@ -78,37 +51,202 @@ class Board(Base):
     status = sa.Column(sa.Unicode(10), nullable=False, default='active')
     rows = sa.Column(sa.Integer(), nullable=False)
     columns = sa.Column(sa.Integer(), nullable=False)
-    mines_list = sa.Column(postgresql.JSON)
-    last_plays_state = sa.Column(postgresql.JSON)
+    # Packed game columns are only loaded by the code paths that need them, with undefer_group('layout') for
+    # the mines and their adjacency grid, and undefer_group('state') for the snapshot of the cells state
+    mines_data = deferred(sa.Column(sa.LargeBinary), group='layout')
+    snapshot_data = deferred(sa.Column(sa.LargeBinary), group='state')
+    adjacent_mines_data = deferred(sa.Column(sa.LargeBinary), group='layout')
+    # Moves logged in board_moves, and how many of them were played when `snapshot_data` was taken
+    moves_count = sa.Column(sa.Integer(), nullable=False, default=0, server_default='0')
+    snapshot_seq = sa.Column(sa.Integer(), nullable=False, default=0, server_default='0')
+    mines = sa.Column(sa.Integer(), nullable=True)
+    hidden_safe_cells = sa.Column(sa.Integer(), nullable=True)
     result = sa.Column(sa.Unicode, nullable=True, default=None)
     owner_id = sa.Column(sa.Unicode, sa.ForeignKey('users.id'), nullable=False)
     owner = relationship("User", back_populates="boards")
+    move_log = relationship("BoardMove", lazy='dynamic', order_by="BoardMove.seq")
+    # Incremented by every update of the row, which only succeeds while the version is still the loaded one
+    version = sa.Column(sa.Integer(), nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {
+        'version_id_col': version
+    }
+
+    @property
+    def state_data(self):
+        """
+        Packed cells state (4 bits per cell): the last snapshot, with the moves logged after it replayed on top.
+        """
+        if not getattr(self, '_state_loaded', False):
+            self.load_state()
+        return self._state_data
+
+    @state_data.setter
+    def state_data(self, data):
+        self._state_data = data
+        self._state_loaded = True
+
+    def load_state(self):
+        self._state_data = self.snapshot_data
+        self._state_loaded = True
+        self._logged_moves = []
+        if (self.moves_count or 0) > (self.snapshot_seq or 0):
+            self.replay(self.move_log.filter(BoardMove.seq > self.snapshot_seq))
+
+    def replay(self, moves):
+        """
+        Replays logged moves on the state. The state is snapshotted whenever the board stops being active, so
+        these moves never ended the game and every cell they revealed was safe: only the cells need to change.
+        """
+        if self.adjacent_mines is None:
+            self.compute_adjacent_mines()
+        state = self.state
+        for move in moves:
+            if move.action == 'flag':
+                state[move.row][move.col] = 'f' if state[move.row][move.col] == '-' else '-'
+                continue
+            cells = [(move.row, move.col)]
+            if move.action == 'chord':
+                cells = neighbors(self.rows, self.columns, move.row, move.col)
+            for row, col in cells:
+                if state[row][col] == '-':
+                    reveal_cell(self.adjacent_mines, self.rows, self.columns, state, row, col)
+        self.state = state
+
+    def play(self, action, i, j):
+        """
+        Plays `action` ('reveal', 'flag' or 'chord') on the cell at (i, j), logging it when it succeeds.
+        """
+        ok, message = getattr(self, action)(i, j)
+        if ok:
+            self.moves_count = (self.moves_count or 0) + 1
+            self.logged_moves.append(BoardMove(board_id=self.id, seq=self.moves_count, action=action, row=i, col=j))
+        return ok, message
+
+    @property
+    def logged_moves(self):
+        """
+        Moves played on this instance that are not saved yet.
+        """
+        if getattr(self, '_logged_moves', None) is None:
+            self._logged_moves = []
+        return self._logged_moves
+
+    def save_moves(self, session, snapshot_every):
+        """
+        Adds the logged moves to `session`, and snapshots the state when `snapshot_every` moves were played since
+        the last snapshot or the board is no longer active.
+        """
+        session.add_all(self.logged_moves)
+        self._logged_moves = []
+        if self.status != 'active' or self.moves_count - (self.snapshot_seq or 0) >= snapshot_every:
+            self.snapshot_data = self.state_data
+            self.snapshot_seq = self.moves_count
 
     @property
     def state(self):
-        if not self.last_plays_state:
-            return [
-                ['-' for j in range(self.columns)] for i in range(self.rows)
-            ]
-        return self.last_plays_state
+        """
+        Matrix of cell values, decoded once from `state_data` (4 bits per cell) and kept until the column changes.
+        """
+        if getattr(self, '_state', None) is None or self._state_source is not self.state_data:
+            if not self.state_data:
+                self._state = [
+                    ['-' for j in range(self.columns)] for i in range(self.rows)
+                ]
+            else:
+                self._state = decode_grid(self.state_data, self.rows, self.columns)
+            self._state_source = self.state_data
+        return self._state
 
     @state.setter
     def state(self, state):
-        self.last_plays_state = state
+        self.state_data = encode_grid(state)
+        self._state = state
+        self._state_source = self.state_data
+
+    @property
+    def changes(self):
+        """
+        Cells changed on this instance as [row, col, value] items, in the order they changed.
+        """
+        if getattr(self, '_changes', None) is None:
+            self._changes = []
+        return self._changes
+
+    def clear_changes(self):
+        self._changes = []
 
     def update_state(self, i, j, value):
+        self.state[i][j] = value
+        self.changes.append([i, j, value])
+        self.store_cells([(i, j)])
+
+    def store_cells(self, cells):
+        """
+        Writes the (row, col) `cells` changed in `state` to `state_data`, patching their nibbles instead of packing
+        the whole grid again, so that a move costs the cells it changes.
+        """
         state = self.state
-        state[i][j] = value
-        self.state = state
+        if not self.state_data:
+            self.state = state
+        else:
+            self.state_data = replace_cells(self.state_data,
+                                            ((row * self.columns + col, state[row][col]) for row, col in cells))
+            self._state_source = self.state_data
 
-    def generate_mines(self, mines):
-        self.mines_list = []
-        while mines > 0:
-            rand_row = random.randint(0, self.rows - 1)
-            rand_column = random.randint(0, self.columns - 1)
-            if [rand_row, rand_column] not in self.mines_list:
-                self.mines_list.append([rand_row, rand_column])
-                mines -= 1
+    @property
+    def mine_index(self):
+        """
+        Set of linear offsets (row * columns + col) of the cells holding a mine, decoded once from the
+        `mines_data` bitmap.
+        """
+        if getattr(self, '_mine_index', None) is None or self._mine_index_source is not self.mines_data:
+            self._mine_index = decode_mines(self.mines_data or b'')
+            self._mine_index_source = self.mines_data
+        return self._mine_index
+
+    @property
+    def adjacent_mines(self):
+        if not self.adjacent_mines_data:
+            return None
+        if getattr(self, '_adjacent_mines', None) is None or \
+                self._adjacent_mines_source is not self.adjacent_mines_data:
+            self._adjacent_mines = decode_grid(self.adjacent_mines_data, self.rows, self.columns)
+            self._adjacent_mines_source = self.adjacent_mines_data
+        return self._adjacent_mines
+
+    def is_mine(self, i, j):
+        return i * self.columns + j in self.mine_index
+
+    def generate_mines(self, mines, seed=None, exclude=()):
+        mine_index = place_mines(self.rows * self.columns, mines, seed=seed, exclude=exclude)
+        self.mines = mines
+        self.mines_data = encode_mines(mine_index, self.rows * self.columns)
+        self._mine_index = mine_index
+        self._mine_index_source = self.mines_data
+        self.hidden_safe_cells = self.rows * self.columns - len(mine_index)
+
+    def place_mines_around(self, i, j):
+        """
+        Places the mines of a board created without them, keeping the cell at (i, j) and, when there are enough
+        free cells left, its neighbors safe.
+        """
+        cells = self.rows * self.columns
+        safe_area = {i * self.columns + j}
+        safe_area.update(row * self.columns + col for row, col in neighbors(self.rows, self.columns, i, j))
+        if cells - len(safe_area) < self.mines:
+            safe_area = {i * self.columns + j} if cells > self.mines else set()
+        self.generate_mines(self.mines, exclude=safe_area)
+        self.compute_adjacent_mines()
+
+    def compute_adjacent_mines(self):
+        adjacent_mines = game.engine.count_adjacent_mines(self.mine_index, self.rows, self.columns)
+        self.adjacent_mines_data = encode_grid(adjacent_mines)
+        self._adjacent_mines = adjacent_mines
+        self._adjacent_mines_source = self.adjacent_mines_data
+
+    def count_hidden_safe_cells(self):
+        self.hidden_safe_cells = game.engine.count_hidden_safe_cells(self)
 
     def check_active_status(self, archived_message='This board is archived. Game is over',
                             paused_message='This board is paused. Resume it in order to continue playing'):
@@ -158,7 +296,9 @@ class Board(Base):
         active, message = self.check_active_status()
         if active:
             if self.state[i][j] == '-':
-                if [i, j] in self.mines_list:
+                if self.mines_data is None:
+                    self.place_mines_around(i, j)
+                if self.is_mine(i, j):
                     self.status = 'archived'
                     self.result = 'lost'
                     self.ended_date = datetime.utcnow()
@@ -166,14 +306,21 @@ class Board(Base):
                     self.update_state(i, j, 'x')
                     self.check_mines_and_wrong_flags()
                 else:
-                    self.state = reveal_cell(self.mines_list, self.rows, self.columns, self.state, i, j)
-                    end, new_state = self.check_end_game()
-                    if end:
+                    if self.adjacent_mines is None:
+                        self.compute_adjacent_mines()
+                    if self.hidden_safe_cells is None:
+                        self.count_hidden_safe_cells()
+                    state = self.state
+                    revealed = reveal_cell(self.adjacent_mines, self.rows, self.columns, state, i, j)
+                    self.store_cells(revealed)
+                    self.changes.extend([row, col, state[row][col]] for row, col in revealed)
+                    self.hidden_safe_cells -= len(revealed)
+                    if self.check_end_game():
                         self.status = 'archived'
                         self.result = 'win'
                         self.ended_date = datetime.utcnow()
                         self.calculate_elapsed_time()
-                        self.state = new_state
+                        self.mark_mines()
                 return True, message
             elif self.state[i][j] == 'f':
                 return False, "Cell in row {} and col {} can't be revealed because is flagged".format(i, j)
@@ -181,23 +328,72 @@ class Board(Base):
                 return False, "Cell in row {} and col {} is already revealed"
         return False, message
 
+    def chord(self, i, j):
+        active, message = self.check_active_status()
+        if active:
+            value = self.state[i][j]
+            if not isinstance(value, int):
+                return False, "Cell in row {} and col {} can't be chorded because is not revealed".format(i, j)
+            cell_neighbors = list(neighbors(self.rows, self.columns, i, j))
+            flags = sum(1 for row, col in cell_neighbors if self.state[row][col] == 'f')
+            if flags != value:
+                return False, "Cell in row {} and col {} can't be chorded because it has {} flagged neighbors " \
+                              "instead of {}".format(i, j, flags, value)
+            for row, col in cell_neighbors:
+                if self.status != 'active':
+                    break
+                if self.state[row][col] == '-':
+                    self.reveal(row, col)
+            return True, message
+        return False, message
+
     def check_end_game(self):
-        state = copy.deepcopy(self.state)
-        for row in range(self.rows):
-            for col in range(self.columns):
-                if self.state[row][col] in ('-', 'f') and [row, col] not in self.mines_list:
-                    return False, None
-                elif self.state[row][col] not in ('x', 'f') and [row, col] in self.mines_list:
-                    state[row][col] = '@'
-        return True, state
+        return self.hidden_safe_cells == 0
+
+    def mark_mines(self):
+        state = self.state
+        marked = []
+        for offset in self.mine_index:
+            row, col = divmod(offset, self.columns)
+            if state[row][col] == '-':
+                state[row][col] = '@'
+                self.changes.append([row, col, '@'])
+                marked.append((row, col))
+        self.store_cells(marked)
 
     def check_mines_and_wrong_flags(self):
-        for row in range(self.rows):
-            for col in range(self.columns):
-                if self.state[row][col] == '-' and [row, col] in self.mines_list:
-                    self.update_state(row, col, '@')
-                elif self.state[row][col] == 'f' and [row, col] not in self.mines_list:
-                    self.update_state(row, col, 'w')
+        state = self.state
+        cells = []
+        for row, col, value in game.engine.mines_and_wrong_flags(self):
+            state[row][col] = value
+            self.changes.append([row, col, value])
+            cells.append((row, col))
+        self.store_cells(cells)
 
     def __repr__(self):
         return '<Board id={} size={}x{} status={}>'.format(self.id, self.rows, self.columns, self.status)
+
+
+@sa.event.listens_for(Board, 'load')
+@sa.event.listens_for(Board, 'refresh')
+def reset_state(board, context, attrs=None):
+    """
+    Drops the state built on a board when its snapshot is (re)loaded from the database.
+    """
+    if attrs is None or 'snapshot_data' in attrs:
+        board._state_loaded = False
+
+
+class BoardMove(Base):
+    __tablename__ = 'board_moves'
+
+    board_id = sa.Column(sa.Unicode(25), sa.ForeignKey('boards.id'), primary_key=True)
+    seq = sa.Column(sa.Integer(), primary_key=True, autoincrement=False)
+    action = sa.Column(sa.Unicode(10), nullable=False)
+    row = sa.Column(sa.Integer(), nullable=False)
+    col = sa.Column(sa.Integer(), nullable=False)
+    created_date = sa.Column(sa.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return '<BoardMove board_id={} seq={} action={} row={} col={}>'.format(
+            self.board_id, self.seq, self.action, self.row, self.col)
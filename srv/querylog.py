@@ -0,0 +1,59 @@
+import logging
+import time
+import sqlalchemy as sa
+from flask import g, request, current_app, has_request_context
+from . import database as db
+
+logger = logging.getLogger(__name__)
+
+# Statements taking at least this many milliseconds are logged, None to disable
+slow_query_threshold = None
+# Whether requests fail when they run more statements than the query_budget of their resource
+budgets_enforced = False
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def init_query_log(app):
+    """
+    Logs the SQL statements slower than SLOW_QUERY_THRESHOLD_MS with their endpoint and, with
+    QUERY_BUDGETS_ENFORCED, fails the requests about to run more statements than the `query_budget` of their
+    resource, before anything is committed. The writes of the board cache are not counted.
+    """
+    global slow_query_threshold, budgets_enforced
+    slow_query_threshold = app.config.get('SLOW_QUERY_THRESHOLD_MS')
+    budgets_enforced = app.config.get('QUERY_BUDGETS_ENFORCED', False)
+    if slow_query_threshold is not None or budgets_enforced:
+        sa.event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        sa.event.listen(db.engine, 'after_cursor_execute', after_cursor_execute)
+
+
+def current_endpoint():
+    return request.endpoint if has_request_context() else None
+
+
+def query_budget(endpoint):
+    """
+    Number of SQL statements the resource handling `endpoint` may run per request, None when it has no budget.
+    """
+    view = current_app.view_functions.get(endpoint)
+    return getattr(getattr(view, 'view_class', None), 'query_budget', None)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    endpoint = current_endpoint()
+    if budgets_enforced and endpoint and not g.get('writing_board_cache'):
+        g.query_count = g.get('query_count', 0) + 1
+        budget = query_budget(endpoint)
+        if budget is not None and g.query_count > budget:
+            raise QueryBudgetExceeded('{} {} exceeded its budget of {} SQL statements with: {}'.format(
+                request.method, endpoint, budget, statement))
+    conn.info.setdefault('query_log_start', []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = (time.perf_counter() - conn.info['query_log_start'].pop()) * 1000
+    if slow_query_threshold is not None and elapsed >= slow_query_threshold:
+        logger.warning('Slow query (%.1f ms) on %s: %s', elapsed, current_endpoint() or 'no endpoint', statement)
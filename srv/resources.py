@@ -1,18 +1,131 @@
+import itertools
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
+from sqlalchemy.orm import undefer_group
+from flask import current_app, request, Response
+from werkzeug.http import quote_etag
 from marshmallow.utils import isoformat
-from sqlalchemy.orm.attributes import flag_modified
 from flask_restful import Resource, abort
 from flask_jwt import jwt_required, current_identity
 from flask_restful_swagger_2 import swagger
-from .utils import get_object_or_404, check_ownership
-from .schemas import (RegisterUserSchema, UserSchema, CreateBoardSchema, MinimalBoardSchema, BoardSchema,
-                      RevealOrFlagSchema)
+from .utils import get_owned_object_or_404
+from .schemas import (RegisterUserSchema, UserSchema, CreateBoardSchema, ListBoardsSchema, MinimalBoardSchema,
+                      BoardSchema, BoardChangesSchema, RevealOrFlagSchema, MovesSchema)
+from . import cache
 from . import database as db
 from .models import User, Board
-from .utils import parse_args, serialize
+from .utils import parse_args, serialize, wants_changes, encode_cursor
+
+GAME_COLUMNS = [undefer_group('layout'), undefer_group('state')]
+
+# Board statuses in the order boards are listed
+LISTING_STATUSES = ['active', 'paused', 'archived']
+
+
+def get_board_to_update(board_id, options=()):
+    """
+    Gets the board to update loaded with `options`: locked for update with the pessimistic BOARD_LOCKING, or
+    read without locks with the optimistic one, where the update only succeeds if the board version is unchanged.
+    """
+    for_update = current_app.config.get('BOARD_LOCKING', 'pessimistic') != 'optimistic'
+    return get_owned_object_or_404(db.session, board_id, Board, current_identity, for_update=for_update,
+                                   options=options)
+
+
+def update_board(board_id, update, options=()):
+    """
+    Applies `update(board)`, which returns the response payload or aborts, and commits it. Updates conflicting
+    with another one are retried up to BOARD_UPDATE_RETRIES times, and then answered with 409.
+    """
+    retries = current_app.config.get('BOARD_UPDATE_RETRIES', 3)
+    for attempt in itertools.count():
+        board = get_board_to_update(board_id, options)
+        board.clear_changes()
+        payload = update(board)
+        board.save_moves(db.session, current_app.config.get('BOARD_SNAPSHOT_EVERY', 50))
+        try:
+            db.session.flush()
+            db.session.commit()
+            return payload
+        except StaleDataError:
+            db.session.rollback()
+            if attempt >= retries:
+                abort(409, message='The board was updated by another request, try again')
+
+
+def play_on_board(board_id, move, options=GAME_COLUMNS):
+    """
+    Plays `move(board)`, which returns the response payload and the number of moves played or aborts, on the
+    cached board when the board cache is enabled, or otherwise on the board loaded with `options`.
+    """
+    if not cache.board_cache:
+        return update_board(board_id, lambda board: move(board)[0], options=options)
+    board = cache.board_cache.get(board_id, current_identity.id)
+    if board is None:
+        board = get_owned_object_or_404(db.session, board_id, Board, current_identity, options=GAME_COLUMNS)
+        if board.status != 'active':
+            # Only boards being played are cached, the paused or finished board refuses the move itself
+            return move(board)[0]
+        cache.board_cache.add(board)
+    board.clear_changes()
+    payload, moves = move(board)
+    try:
+        cache.board_cache.played(board, moves)
+    except StaleDataError:
+        # The board was updated out of this worker's cache, whose copy of it is no longer valid
+        db.session.rollback()
+        cache.board_cache.discard(board_id)
+        abort(409, message='The board was updated by another request, try again')
+    return payload
+
+
+def evict_cached_board(board_id):
+    """
+    Writes the moves of the cached board of the current user and drops it from the cache, before the board is
+    updated in the database. The boards of other users are left alone, their update is refused anyway.
+    """
+    if not cache.board_cache or cache.board_cache.get(board_id, current_identity.id) is None:
+        return
+    try:
+        cache.board_cache.evict(board_id)
+    except StaleDataError:
+        # The board was updated out of this worker's cache, whose copy of it was dropped
+        db.session.rollback()
+        abort(409, message='The board was updated by another request, try again')
+
+
+def board_etag(board_id, version, pending_moves=0):
+    """
+    Strong ETag of a board, from its version and, for cached boards, the moves not written to the database yet.
+    """
+    if pending_moves:
+        return '{}-{}.{}'.format(board_id, version, pending_moves)
+    return '{}-{}'.format(board_id, version)
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag)
+    return response
+
+
+def play_cell(action):
+    """
+    Returns the move playing the board method `action` on the cell of the request.
+    """
+    def move(board):
+        args = parse_args(RevealOrFlagSchema, context={'board': board})
+        ok, message = board.play(action, args.get('row'), args.get('col'))
+        if not ok:
+            abort(400, message=message)
+        return serialize(board, BoardChangesSchema if wants_changes() else BoardSchema), 1
+    return move
 
 
 class PingProtectedResource(Resource):
     decorators = [jwt_required()]
+    query_budget = 1
 
     @swagger.doc({
         'tags': ['ping'],
@@ -45,6 +158,8 @@ class PingProtectedResource(Resource):
 
 
 class RegisterResource(Resource):
+    query_budget = 1
+
     @swagger.doc({
         'tags': ['users'],
         'description': 'Registers a user',
@@ -104,14 +219,22 @@ class RegisterResource(Resource):
     def post(self):
         args = parse_args(RegisterUserSchema)
         u = User(username=args.get('username'))
-        u.set_password(args.get('password'))
+        # Hashing happens before touching the database, so no pooled connection is held while it runs
+        u.set_password(args.get('password'), method=current_app.config.get('PASSWORD_HASH_METHOD'))
         db.session.add(u)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            abort(400, username=['This username is already taken'])
+        payload = serialize(u, UserSchema)
         db.session.commit()
-        return serialize(u, UserSchema)
+        return payload
 
 
 class BoardsResource(Resource):
     decorators = [jwt_required()]
+    query_budget = 2
 
     @swagger.doc({
         'tags': ['boards'],
@@ -199,18 +322,48 @@ class BoardsResource(Resource):
     })
     def post(self):
         args = parse_args(CreateBoardSchema)
-        board = Board(owner=current_identity, rows=args.get('rows'), columns=args.get('columns'))
-        board.generate_mines(mines=args.get('mines'))
+        # A new board has no snapshot, set so that serializing it doesn't load it back after the insert
+        board = Board(owner_id=current_identity.id, rows=args.get('rows'), columns=args.get('columns'),
+                      mines=args.get('mines'), snapshot_data=None)
+        if not current_app.config.get('LAZY_MINE_PLACEMENT'):
+            board.generate_mines(mines=board.mines)
+            board.compute_adjacent_mines()
         db.session.add(board)
+        db.session.flush()
+        payload = serialize(board, BoardSchema)
         db.session.commit()
-        return serialize(board, BoardSchema), 201
+        return payload, 201
 
     @swagger.doc({
         'tags': ['boards'],
-        'description': 'List boards',
+        'description': 'List boards, active ones first, then paused and archived, newest first',
+        'parameters': [
+            {
+                'in': 'query',
+                'name': 'limit',
+                'description': 'Maximum number of boards to return (1 to 200, 50 by default)',
+                'type': 'integer',
+                'required': False
+            },
+            {
+                'in': 'query',
+                'name': 'cursor',
+                'description': 'Value of the X-Next-Cursor header of the previous page',
+                'type': 'string',
+                'required': False
+            },
+            {
+                'in': 'query',
+                'name': 'status',
+                'description': 'Only list boards with this status',
+                'type': 'string',
+                'enum': ['active', 'paused', 'archived'],
+                'required': False
+            }
+        ],
         'responses': {
             '200': {
-                'description': 'List of boards',
+                'description': 'List of boards. The X-Next-Cursor header is set when there are more boards',
                 'schema': {
                     'type': 'array',
                     'items': {
@@ -255,17 +408,39 @@ class BoardsResource(Resource):
         }
     })
     def get(self):
-        status_dict = {
-            'active': 0,
-            'paused': 1,
-            'archived': 2
-        }
-        return sorted(serialize(current_identity.boards, MinimalBoardSchema),
-                      key=lambda o: status_dict.get(o.get('status')))
+        args = parse_args(ListBoardsSchema, location='query')
+        limit = args.get('limit')
+        cursor = args.get('cursor')
+        pages = []
+        for rank, status in enumerate(LISTING_STATUSES):
+            if args.get('status', status) != status or (cursor and rank < cursor[0]):
+                continue
+            # Seeks within a single status, so that the (owner_id, status, created_date, id) index serves both the
+            # cursor and the order, and the statuses are concatenated in the listing order
+            page = db.session.query(Board.id, Board.created_date, Board.status, Board.result, Board.rows,
+                                    Board.columns, sa.literal(rank, sa.Integer).label('status_rank')) \
+                .filter(Board.owner_id == current_identity.id, Board.status == status)
+            if cursor and rank == cursor[0]:
+                page = page.filter(sa.tuple_(Board.created_date, Board.id) < sa.tuple_(cursor[1], cursor[2]))
+            pages.append(page.order_by(Board.created_date.desc(), Board.id.desc()).limit(limit + 1)
+                         .subquery().select())
+        if not pages:
+            return [], 200
+        listing = sa.union_all(*pages).alias('listing')
+        boards = db.session.query(listing) \
+            .order_by(listing.c.status_rank, listing.c.created_date.desc(), listing.c.id.desc()) \
+            .limit(limit + 1).all()
+        headers = {}
+        if len(boards) > limit:
+            boards = boards[:limit]
+            last = boards[-1]
+            headers['X-Next-Cursor'] = encode_cursor([last.status_rank, last.created_date.isoformat(), last.id])
+        return serialize(boards, MinimalBoardSchema), 200, headers
 
 
 class SingleBoardResource(Resource):
     decorators = [jwt_required()]
+    query_budget = 5
 
     @swagger.doc({
         'tags': ['boards'],
@@ -278,11 +453,21 @@ class SingleBoardResource(Resource):
                 'description': 'Board ID to retrieve',
                 'type': 'string',
                 'required': True
+            },
+            {
+                'in': 'header',
+                'name': 'If-None-Match',
+                'description': 'ETag of the board last retrieved, to get a 304 response when it did not change',
+                'type': 'string',
+                'required': False
             }
         ],
         'responses': {
+            '304': {
+                'description': 'The board did not change since the ETag of If-None-Match'
+            },
             '200': {
-                'description': 'Board',
+                'description': 'Board. The ETag header identifies its current version',
                 'schema': {
                     'type': 'object',
                     'properties': {
@@ -363,13 +548,27 @@ class SingleBoardResource(Resource):
         }
     })
     def get(self, board_id):
-        board = get_object_or_404(db.session, board_id, Board)
-        check_ownership(board, current_identity)
-        return serialize(board, BoardSchema)
+        board = cache.board_cache.get(board_id, current_identity.id) if cache.board_cache else None
+        if board is None:
+            if request.if_none_match:
+                # Checks the ETag against the version alone, before loading and serializing the state
+                version = db.session.query(Board.version) \
+                    .filter(Board.id == board_id, Board.owner_id == current_identity.id).scalar()
+                if version is not None and request.if_none_match.contains_weak(board_etag(board_id, version)):
+                    return not_modified(board_etag(board_id, version))
+            board = get_owned_object_or_404(db.session, board_id, Board, current_identity,
+                                            options=[undefer_group('state')])
+            etag = board_etag(board.id, board.version)
+        else:
+            etag = board_etag(board.id, board.version, cache.board_cache.pending_moves(board.id))
+            if request.if_none_match.contains_weak(etag):
+                return not_modified(etag)
+        return serialize(board, BoardSchema), 200, {'ETag': quote_etag(etag)}
 
 
 class RevealResource(Resource):
     decorators = [jwt_required()]
+    query_budget = 5
 
     @swagger.doc({
         'tags': ['boards'],
@@ -383,6 +582,13 @@ class RevealResource(Resource):
                 'type': 'string',
                 'required': True
             },
+            {
+                'in': 'query',
+                'name': 'changes',
+                'description': 'Respond only with the cells changed by the move instead of the whole state',
+                'type': 'boolean',
+                'required': False
+            },
             {
                 'in': 'body',
                 'name': 'body',
@@ -486,22 +692,141 @@ class RevealResource(Resource):
         }
     })
     def post(self, board_id):
-        board = get_object_or_404(db.session, board_id, Board, for_update=True)
-        check_ownership(board, current_identity)
-        args = parse_args(RevealOrFlagSchema, context={'board': board})
-        ok, message = board.reveal(args.get('row'), args.get('col'))
-        if ok:
-            flag_modified(board, "last_plays_state")
-            payload = serialize(board, BoardSchema)
-            db.session.flush()
-            db.session.commit()
-            return payload
-        else:
-            abort(400, message=message)
+        return play_on_board(board_id, play_cell('reveal'))
+
+
+class ChordResource(Resource):
+    decorators = [jwt_required()]
+    query_budget = 5
+
+    @swagger.doc({
+        'tags': ['boards'],
+        'description': 'Reveals the hidden neighbors of a revealed cell with as many flagged neighbors as its number',
+        'produces': ['application/json'],
+        'parameters': [
+            {
+                'in': 'path',
+                'name': 'board_id',
+                'description': 'Board ID to play on',
+                'type': 'string',
+                'required': True
+            },
+            {
+                'in': 'query',
+                'name': 'changes',
+                'description': 'Respond only with the cells changed by the move instead of the whole state',
+                'type': 'boolean',
+                'required': False
+            },
+            {
+                'in': 'body',
+                'name': 'body',
+                'description': 'Data needed for chording a cell',
+                'required': True,
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'row': {
+                            'type': 'integer',
+                            'description': 'Row index of the cell',
+                        },
+                        'col': {
+                            'type': 'integer',
+                            'description': 'Column index of the cell',
+                        }
+                    }
+                }
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Board',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'id': {
+                            'type': 'string',
+                            'description': 'Unique ID of the board',
+                        },
+                        'created_date': {
+                            'type': 'string',
+                            'format': 'date',
+                            'description': 'Creation date of the board',
+                        },
+                        'ended_date': {
+                            'type': 'string',
+                            'format': 'date',
+                            'description': 'End date of the board',
+                        },
+                        'resume_date': {
+                            'type': 'string',
+                            'format': 'date',
+                            'description': 'Resume date of the board',
+                        },
+                        'elapsed_time': {
+                            'type': 'integer',
+                            'description': 'Elapsed time in seconds',
+                        },
+                        'status': {
+                            'type': 'string',
+                            'description': 'Status of the board',
+                        },
+                        'result': {
+                            'type': 'string',
+                            'description': 'Final result of the game',
+                            'enum': ['win', 'lost']
+                        },
+                        'state': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'array',
+                                'items': {
+                                    'type': 'string',
+                                    'description': 'Cell value',
+                                    'enum': ['-', 'x', 'f', 'w', '@', '1-8']
+                                }
+                            }
+                        }
+                    }
+                },
+                'examples': {
+                    'application/json': {
+                        "created_date": "2018-06-10T21:04:24.927742+00:00",
+                        "elapsed_time": None,
+                        "ended_date": None,
+                        "id": "S6JHB76R2BFA3KMR6Y",
+                        "result": None,
+                        "resume_date": None,
+                        "state": [
+                            [
+                                "1",
+                                "2",
+                                "2"
+                            ],
+                            [
+                                "1",
+                                "-",
+                                "-"
+                            ],
+                            [
+                                "-",
+                                "-",
+                                "-"
+                            ]
+                        ],
+                        "status": "active"
+                    }
+                }
+            }
+        }
+    })
+    def post(self, board_id):
+        return play_on_board(board_id, play_cell('chord'))
 
 
 class FlagResource(Resource):
     decorators = [jwt_required()]
+    query_budget = 6
 
     @swagger.doc({
         'tags': ['boards'],
@@ -515,6 +840,13 @@ class FlagResource(Resource):
                 'type': 'string',
                 'required': True
             },
+            {
+                'in': 'query',
+                'name': 'changes',
+                'description': 'Respond only with the cells changed by the move instead of the whole state',
+                'type': 'boolean',
+                'required': False
+            },
             {
                 'in': 'body',
                 'name': 'body',
@@ -618,22 +950,159 @@ class FlagResource(Resource):
         }
     })
     def post(self, board_id):
-        board = get_object_or_404(db.session, board_id, Board, for_update=True)
-        check_ownership(board, current_identity)
-        args = parse_args(RevealOrFlagSchema, context={'board': board})
-        ok, message = board.flag(args.get('row'), args.get('col'))
-        if ok:
-            flag_modified(board, "last_plays_state")
-            payload = serialize(board, BoardSchema)
-            db.session.flush()
-            db.session.commit()
-            return payload
-        else:
+        return play_on_board(board_id, play_cell('flag'), options=[undefer_group('state')])
+
+
+class MovesResource(Resource):
+    decorators = [jwt_required()]
+    query_budget = 5
+
+    @swagger.doc({
+        'tags': ['boards'],
+        'description': 'Plays a list of reveal/flag/chord moves in order, in a single transaction',
+        'produces': ['application/json'],
+        'parameters': [
+            {
+                'in': 'path',
+                'name': 'board_id',
+                'description': 'Board ID to play on',
+                'type': 'string',
+                'required': True
+            },
+            {
+                'in': 'query',
+                'name': 'changes',
+                'description': 'Respond only with the cells changed by the moves instead of the whole state',
+                'type': 'boolean',
+                'required': False
+            },
+            {
+                'in': 'body',
+                'name': 'body',
+                'description': 'Moves to play, applied in order until the game is over',
+                'required': True,
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'moves': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'action': {
+                                        'type': 'string',
+                                        'description': 'Move to play',
+                                        'enum': ['reveal', 'flag', 'chord']
+                                    },
+                                    'row': {
+                                        'type': 'integer',
+                                        'description': 'Row index of the cell',
+                                    },
+                                    'col': {
+                                        'type': 'integer',
+                                        'description': 'Column index of the cell',
+                                    }
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        ],
+        'responses': {
+            '200': {
+                'description': 'Board, with the result of every played move',
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'id': {
+                            'type': 'string',
+                            'description': 'Unique ID of the board',
+                        },
+                        'status': {
+                            'type': 'string',
+                            'description': 'Status of the board',
+                        },
+                        'result': {
+                            'type': 'string',
+                            'description': 'Final result of the game',
+                            'enum': ['win', 'lost']
+                        },
+                        'moves': {
+                            'type': 'array',
+                            'items': {
+                                'type': 'object',
+                                'properties': {
+                                    'action': {
+                                        'type': 'string',
+                                        'description': 'Played move',
+                                    },
+                                    'row': {
+                                        'type': 'integer',
+                                        'description': 'Row index of the cell',
+                                    },
+                                    'col': {
+                                        'type': 'integer',
+                                        'description': 'Column index of the cell',
+                                    },
+                                    'ok': {
+                                        'type': 'boolean',
+                                        'description': 'Whether the move was applied',
+                                    },
+                                    'message': {
+                                        'type': 'string',
+                                        'description': 'Why the move was not applied',
+                                    }
+                                }
+                            }
+                        }
+                    }
+                },
+                'examples': {
+                    'application/json': {
+                        "changes": [
+                            [1, 1, "f"],
+                            [0, 2, 1]
+                        ],
+                        "elapsed_time": None,
+                        "ended_date": None,
+                        "id": "S6JHB76R2BFA3KMR6Y",
+                        "moves": [
+                            {"action": "flag", "row": 1, "col": 1, "ok": True, "message": None},
+                            {"action": "reveal", "row": 0, "col": 2, "ok": True, "message": None},
+                            {"action": "reveal", "row": 1, "col": 1, "ok": False,
+                             "message": "Cell in row 1 and col 1 can't be revealed because is flagged"}
+                        ],
+                        "result": None,
+                        "status": "active"
+                    }
+                }
+            }
+        }
+    })
+    def post(self, board_id):
+        return play_on_board(board_id, self.play_moves)
+
+    def play_moves(self, board):
+        args = parse_args(MovesSchema, context={'board': board})
+        active, message = board.check_active_status()
+        if not active:
             abort(400, message=message)
+        results = []
+        for move in args.get('moves'):
+            if board.status != 'active':
+                break
+            ok, message = board.play(move.get('action'), move.get('row'), move.get('col'))
+            results.append({'action': move.get('action'), 'row': move.get('row'), 'col': move.get('col'),
+                            'ok': ok, 'message': message})
+        payload = serialize(board, BoardChangesSchema if wants_changes() else BoardSchema)
+        payload['moves'] = results
+        return payload, len(results)
 
 
 class PauseBoardResource(Resource):
     decorators = [jwt_required()]
+    query_budget = 8
 
     @swagger.doc({
         'tags': ['boards'],
@@ -669,20 +1138,19 @@ class PauseBoardResource(Resource):
         }
     })
     def post(self, board_id):
-        board = get_object_or_404(db.session, board_id, Board, for_update=True)
-        check_ownership(board, current_identity)
+        evict_cached_board(board_id)
+        return update_board(board_id, self.pause)
+
+    def pause(self, board):
         ok, message = board.pause()
-        if ok:
-            elapsed_time = board.elapsed_time.total_seconds()
-            db.session.flush()
-            db.session.commit()
-            return {"message": 'Successfully paused', "elapsed_time": elapsed_time}
-        else:
+        if not ok:
             abort(400, message=message)
+        return {"message": 'Successfully paused', "elapsed_time": board.elapsed_time.total_seconds()}
 
 
 class ResumeBoardResource(Resource):
     decorators = [jwt_required()]
+    query_budget = 3
 
     @swagger.doc({
         'tags': ['boards'],
@@ -718,13 +1186,11 @@ class ResumeBoardResource(Resource):
         }
     })
     def post(self, board_id):
-        board = get_object_or_404(db.session, board_id, Board, for_update=True)
-        check_ownership(board, current_identity)
+        evict_cached_board(board_id)
+        return update_board(board_id, self.resume)
+
+    def resume(self, board):
         ok, message = board.resume()
-        if ok:
-            resume_date = isoformat(board.resume_date)
-            db.session.flush()
-            db.session.commit()
-            return {"message": 'Successfully resumed', "resume_date": resume_date}
-        else:
+        if not ok:
             abort(400, message=message)
+        return {"message": 'Successfully resumed', "resume_date": isoformat(board.resume_date)}
@@ -1,6 +1,7 @@
-from marshmallow import Schema, fields, validates, ValidationError, validates_schema
-from .models import User
-from . import database as db
+from dateutil.parser import isoparse
+from marshmallow import Schema, fields, validates, ValidationError, validates_schema, post_load
+from marshmallow.validate import Length, OneOf, Range
+from .utils import decode_cursor
 
 
 class UserSchema(Schema):
@@ -12,11 +13,6 @@ class RegisterUserSchema(Schema):
     username = fields.String(required=True)
     password = fields.String(required=True)
 
-    @validates('username')
-    def validate_username(self, value):
-        if db.session.query(User).filter(User.username == value).first():
-            raise ValidationError('This username is already taken')
-
 
 class CreateBoardSchema(Schema):
     rows = fields.Integer(required=True, validate=lambda value: value > 0)
@@ -29,6 +25,22 @@ class CreateBoardSchema(Schema):
             raise ValidationError('mines total must be less than total cells')
 
 
+class ListBoardsSchema(Schema):
+    limit = fields.Integer(missing=50, validate=Range(min=1, max=200))
+    cursor = fields.Function(deserialize=decode_cursor)
+    status = fields.String(validate=OneOf(['active', 'paused', 'archived']))
+
+    @post_load
+    def unpack_cursor(self, data):
+        if 'cursor' in data:
+            try:
+                status_rank, created_date, board_id = data['cursor']
+                data['cursor'] = int(status_rank), isoparse(created_date), str(board_id)
+            except (ValueError, TypeError):
+                raise ValidationError('invalid cursor', 'cursor')
+        return data
+
+
 class MinimalBoardSchema(Schema):
     id = fields.String()
     created_date = fields.DateTime()
@@ -47,7 +59,16 @@ class BoardSchema(Schema):
     status = fields.String()
     result = fields.String()
     state = fields.Function(lambda o: o.state)
-    mines = fields.Function(lambda o: len(o.mines_list))
+    mines = fields.Integer()
+
+
+class BoardChangesSchema(Schema):
+    id = fields.String()
+    ended_date = fields.DateTime()
+    elapsed_time = fields.TimeDelta()
+    status = fields.String()
+    result = fields.String()
+    changes = fields.Function(lambda o: o.changes)
 
 
 class RevealOrFlagSchema(Schema):
@@ -65,3 +86,11 @@ class RevealOrFlagSchema(Schema):
         board = self.context.get('board')
         if value >= board.columns:
             raise ValidationError('col out of range')
+
+
+class MoveSchema(RevealOrFlagSchema):
+    action = fields.String(required=True, validate=OneOf(['reveal', 'flag', 'chord']))
+
+
+class MovesSchema(Schema):
+    moves = fields.Nested(MoveSchema, many=True, required=True, validate=Length(min=1, max=1000))
@@ -1,28 +1,61 @@
+import base64
+import json
+import time
+import sqlalchemy as sa
 from flask import request
 from flask_restful import abort
 from marshmallow import ValidationError
+from . import metrics
 
+CHANGES_MIMETYPE = 'application/vnd.minesweeper.changes+json'
 
-def parse_args(klass, context=None):
+
+def parse_args(klass, context=None, location='json'):
     try:
         schema = klass()
         if context:
             schema.context.update(context)
+        if location == 'query':
+            return schema.load(request.args.to_dict())
         return schema.load(request.get_json() or {})
     except ValidationError as err:
         abort(400, **err.messages)
 
 
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor):
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, TypeError):
+        raise ValidationError('invalid cursor')
+
+
 def serialize(obj, klass):
+    start = time.perf_counter()
     many = False
     if isinstance(obj, list):
         many = True
     schema = klass(many=many)
-    return schema.dump(obj)
+    data = schema.dump(obj)
+    metrics.record_serialization(time.perf_counter() - start)
+    return data
+
+
+def wants_changes():
+    """
+    Whether the client asked for only the changed cells of a move, with `?changes=true` or by accepting
+    the `CHANGES_MIMETYPE` media type.
+    """
+    if request.args.get('changes', '').lower() in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', CHANGES_MIMETYPE]) == CHANGES_MIMETYPE
 
 
-def get_object_or_404(session, id, model, for_update=False):
-    query = session.query(model)
+def get_object_or_404(session, id, model, for_update=False, options=()):
+    query = session.query(model).options(*options)
     if for_update:
         query = query.with_for_update()
     o = query.filter(model.id == id).first()
@@ -31,6 +64,22 @@ def get_object_or_404(session, id, model, for_update=False):
     return o
 
 
-def check_ownership(obj, user, owner_field='owner'):
-    if getattr(obj, owner_field) != user:
+def get_owned_object_or_404(session, id, model, user, for_update=False, options=(), owner_field='owner_id'):
+    """
+    Fetches the object with `id` owned by `user` in a single statement. Only when nothing matches, the existence
+    of the object is checked to answer 403 instead of 404.
+    """
+    query = session.query(model).options(*options)
+    if for_update:
+        query = query.with_for_update()
+    o = query.filter(model.id == id, getattr(model, owner_field) == user.id).first()
+    if not o:
+        if session.query(sa.exists().where(model.id == id)).scalar():
+            abort(403, message="You are not allowed to access this {}".format(model.__name__.lower()))
+        abort(404, message="{} with id '{}' not found".format(model.__name__, id))
+    return o
+
+
+def check_ownership(obj, user, owner_field='owner_id'):
+    if getattr(obj, owner_field) != user.id:
         abort(403, message="You are not allowed to access this {}".format(obj.__class__.__name__.lower()))